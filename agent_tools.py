@@ -2,18 +2,75 @@
 LangChain Tools for the Appointment Scheduling Agent
 """
 
-from typing import Optional, Dict, Any
+import asyncio
+from typing import Optional, Dict, Any, Type
 from langchain.tools import BaseTool
-from pydantic import Field
-from datetime import datetime
+from pydantic import BaseModel, Field, ValidationError
+from datetime import date, datetime, time
 
-from mock_calendly import calendly_api
+from mock_calendly import get_calendly_api
 from schemas import (
-    AvailabilityRequest,
-    AppointmentRequest,
-    PatientInfo
+    APPOINTMENT_REQUEST_ADAPTER,
+    AVAILABILITY_REQUEST_ADAPTER,
+    BookAppointmentArgs,
+    BookingStatus,
+    APPOINTMENT_TYPES
 )
-from faq_rag import get_rag_system
+from faq_rag import get_rag_system, NO_RESULTS_CONTEXT
+
+
+# Valid appointment types, and the list quoted back when an invalid one is given
+_VALID_APPOINTMENT_TYPES = frozenset(APPOINTMENT_TYPES)
+_VALID_APPOINTMENT_TYPES_MSG = ", ".join(APPOINTMENT_TYPES)
+
+
+# 12-hour display format for every quarter-hour start time (the slot grid),
+# so formatting a slot is a dict lookup instead of strftime
+_TIME_TO_12H = {
+    time(h, m): time(h, m).strftime("%I:%M %p").lstrip("0")
+    for h in range(24)
+    for m in (0, 15, 30, 45)
+}
+
+
+def _format_time_12h(t: time) -> str:
+    """Format a time in 12-hour format (e.g. 14:00 -> 2:00 PM)"""
+    formatted = _TIME_TO_12H.get(t)
+    if formatted is None:
+        formatted = t.strftime("%I:%M %p").lstrip("0")
+    return formatted
+
+
+# Reply when the knowledge base has nothing relevant to a question
+FAQ_FALLBACK_MESSAGE = """I don't have specific information about that in my knowledge base. 
+For the most accurate and up-to-date information, I recommend:
+- Calling our office at +1-555-123-4567
+- Visiting our website at www.healthcareplus.com
+- Emailing us at info@healthcareplus.com
+
+Is there anything else I can help you with, or would you like to schedule an appointment?"""
+
+
+# Confirmation message returned after a successful booking
+BOOKING_CONFIRMATION_TEMPLATE = """✅ Appointment Successfully Booked!
+
+Confirmation Details:
+- Booking ID: {booking_id}
+- Confirmation Code: {confirmation_code}
+- Patient: {patient_name}
+- Type: {appointment_type}
+- Date: {date}
+- Time: {time}
+- Duration: {end_time}
+- Reason: {reason}
+
+A confirmation email has been sent to {patient_email}.
+
+Important Reminders:
+- Please arrive 15 minutes early to complete any necessary paperwork
+- Bring your insurance card and photo ID
+- If you need to cancel or reschedule, please call us at least 24 hours in advance at +1-555-123-4567
+"""
 
 
 class CheckAvailabilityTool(BaseTool):
@@ -37,46 +94,40 @@ class CheckAvailabilityTool(BaseTool):
         """Check availability for a given date and appointment type"""
         try:
             # Validate appointment type
-            valid_types = ["general_consultation", "follow_up", "physical_exam", "specialist_consultation"]
-            if appointment_type not in valid_types:
-                return f"Error: Invalid appointment type. Must be one of: {', '.join(valid_types)}"
+            if appointment_type not in _VALID_APPOINTMENT_TYPES:
+                return f"Error: Invalid appointment type. Must be one of: {_VALID_APPOINTMENT_TYPES_MSG}"
             
-            # Validate date format
+            # Validate date format (parsed once and reused below)
             try:
-                datetime.strptime(date, "%Y-%m-%d")
+                date_obj = datetime.strptime(date, "%Y-%m-%d")
             except ValueError:
                 return "Error: Date must be in YYYY-MM-DD format (e.g., 2024-01-15)"
             
+            # Weekends and past dates never have slots, so skip the calendar lookup
+            if date_obj.weekday() >= 5:
+                return f"No slots available on {date}. The clinic is closed on weekends. Please choose a weekday (Monday-Friday)."
+            
+            if date_obj.date() < datetime.now().date():
+                return f"No slots available on {date}. This date is in the past. Please choose a future date."
+            
             # Check availability
-            request = AvailabilityRequest(
-                date=date,
-                appointment_type=appointment_type
-            )
+            request = AVAILABILITY_REQUEST_ADAPTER.validate_python({
+                "date": date_obj.date(),
+                "appointment_type": appointment_type
+            })
             
-            response = calendly_api.get_availability(request)
+            response = get_calendly_api().get_availability(request)
             
             if response.total_slots == 0:
-                # Check if it's a weekend
-                date_obj = datetime.strptime(date, "%Y-%m-%d")
-                if date_obj.weekday() >= 5:
-                    return f"No slots available on {date}. The clinic is closed on weekends. Please choose a weekday (Monday-Friday)."
-                
-                # Check if it's in the past
-                if date_obj.date() < datetime.now().date():
-                    return f"No slots available on {date}. This date is in the past. Please choose a future date."
-                
                 return f"No slots available on {date}. The date is fully booked. Would you like to check another date?"
             
-            # Format the response
-            slots_text = []
-            for slot in response.available_slots[:10]:  # Limit to first 10 slots
-                # Convert 24-hour to 12-hour format
-                start_time = datetime.strptime(slot.start_time, "%H:%M")
-                formatted_time = start_time.strftime("%I:%M %p").lstrip("0")
-                slots_text.append(formatted_time)
+            # Format the response (first 10 slots, converted from 24-hour to 12-hour format)
+            slot_lines = "\n".join(
+                f"- {_format_time_12h(slot.start_time)}" for slot in response.available_slots[:10]
+            )
             
             result = f"Available slots on {date} for {appointment_type.replace('_', ' ')}:\n"
-            result += "\n".join(f"- {time}" for time in slots_text)
+            result += slot_lines
             result += f"\n\nTotal available slots: {response.total_slots}"
             
             return result
@@ -85,8 +136,16 @@ class CheckAvailabilityTool(BaseTool):
             return f"Error checking availability: {str(e)}"
     
     async def _arun(self, date: str, appointment_type: str) -> str:
-        """Async version"""
-        return self._run(date, appointment_type)
+        """Async version, run in a worker thread so concurrent tool calls overlap"""
+        return await asyncio.to_thread(self._run, date, appointment_type)
+
+
+def _format_booking_validation_error(error: ValidationError) -> str:
+    """Report invalid book_appointment arguments back to the agent"""
+    problems = "; ".join(
+        f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in error.errors()
+    )
+    return f"Error: Invalid booking details - {problems}"
 
 
 class BookAppointmentTool(BaseTool):
@@ -114,76 +173,56 @@ class BookAppointmentTool(BaseTool):
         Confirmation details including booking ID and confirmation code
     """
     
+    # All arguments are validated by this schema before _run is called
+    args_schema: Type[BaseModel] = BookAppointmentArgs
+    handle_validation_error: Any = _format_booking_validation_error
+    
     def _run(
         self,
         patient_name: str,
         patient_email: str,
         patient_phone: str,
         appointment_type: str,
-        appointment_date: str,
-        start_time: str,
+        appointment_date: date,
+        start_time: time,
         reason: str
     ) -> str:
         """Book an appointment"""
         try:
-            # Validate required fields
-            if not all([patient_name, patient_email, patient_phone, appointment_type, 
-                       appointment_date, start_time, reason]):
-                return "Error: All fields are required to book an appointment."
-            
-            # Create patient info
-            try:
-                patient = PatientInfo(
-                    name=patient_name,
-                    email=patient_email,
-                    phone=patient_phone
-                )
-            except Exception as e:
-                return f"Error: Invalid patient information - {str(e)}"
-            
-            # Create booking request
-            request = AppointmentRequest(
-                appointment_type=appointment_type,
-                appointment_date=appointment_date,
-                start_time=start_time,
-                patient=patient,
-                reason=reason
-            )
+            # Create booking request (patient included, validated in one call)
+            request = APPOINTMENT_REQUEST_ADAPTER.validate_python({
+                "appointment_type": appointment_type,
+                "appointment_date": appointment_date,
+                "start_time": start_time,
+                "patient": {
+                    "name": patient_name,
+                    "email": patient_email,
+                    "phone": patient_phone
+                },
+                "reason": reason
+            })
             
             # Book the appointment
-            response = calendly_api.book_appointment(request)
+            response = get_calendly_api().book_appointment(request)
             
-            if response.status == "failed":
+            if response.status is BookingStatus.FAILED:
                 return f"Booking failed: {response.reason}"
             
             # Format success response
-            start_dt = datetime.strptime(start_time, "%H:%M")
-            formatted_time = start_dt.strftime("%I:%M %p").lstrip("0")
-            
-            date_obj = datetime.strptime(appointment_date, "%Y-%m-%d")
-            formatted_date = date_obj.strftime("%A, %B %d, %Y")
+            formatted_time = _format_time_12h(start_time)
+            formatted_date = appointment_date.strftime("%A, %B %d, %Y")
             
-            result = f"""✅ Appointment Successfully Booked!
-
-Confirmation Details:
-- Booking ID: {response.booking_id}
-- Confirmation Code: {response.confirmation_code}
-- Patient: {patient_name}
-- Type: {appointment_type.replace('_', ' ').title()}
-- Date: {formatted_date}
-- Time: {formatted_time}
-- Duration: {response.end_time}
-- Reason: {reason}
-
-A confirmation email has been sent to {patient_email}.
-
-Important Reminders:
-- Please arrive 15 minutes early to complete any necessary paperwork
-- Bring your insurance card and photo ID
-- If you need to cancel or reschedule, please call us at least 24 hours in advance at +1-555-123-4567
-"""
-            
-            return result
+            return BOOKING_CONFIRMATION_TEMPLATE.format(
+                booking_id=response.booking_id,
+                confirmation_code=response.confirmation_code,
+                patient_name=patient_name,
+                appointment_type=appointment_type.replace('_', ' ').title(),
+                date=formatted_date,
+                time=formatted_time,
+                end_time=response.end_time.strftime("%H:%M"),
+                reason=reason,
+                patient_email=patient_email
+            )
             
         except Exception as e:
             return f"Error booking appointment: {str(e)}"
@@ -194,12 +233,13 @@ Important Reminders:
         patient_email: str,
         patient_phone: str,
         appointment_type: str,
-        appointment_date: str,
-        start_time: str,
+        appointment_date: date,
+        start_time: time,
         reason: str
     ) -> str:
-        """Async version"""
-        return self._run(
+        """Async version, run in a worker thread so the event loop is not blocked"""
+        return await asyncio.to_thread(
+            self._run,
             patient_name, patient_email, patient_phone,
             appointment_type, appointment_date, start_time, reason
         )
@@ -236,14 +276,8 @@ class SearchFAQTool(BaseTool):
             # Get relevant context
             context = self.rag_system.get_context_for_query(question, n_results=3)
             
-            if context == "No relevant information found in the knowledge base.":
-                return """I don't have specific information about that in my knowledge base. 
-For the most accurate and up-to-date information, I recommend:
-- Calling our office at +1-555-123-4567
-- Visiting our website at www.healthcareplus.com
-- Emailing us at info@healthcareplus.com
-
-Is there anything else I can help you with, or would you like to schedule an appointment?"""
+            if context is NO_RESULTS_CONTEXT:
+                return FAQ_FALLBACK_MESSAGE
             
             return context
             
@@ -251,8 +285,8 @@ Is there anything else I can help you with, or would you like to schedule an app
             return f"I'm having trouble accessing that information right now. Please call our office at +1-555-123-4567 for assistance."
     
     async def _arun(self, question: str) -> str:
-        """Async version"""
-        return self._run(question)
+        """Async version, run in a worker thread so concurrent tool calls overlap"""
+        return await asyncio.to_thread(self._run, question)
 
 
 # Create tool instances
@@ -3,8 +3,10 @@ Medical Appointment Scheduling Agent - Streamlit Application
 Interactive chat interface for scheduling appointments
 """
 
+import logging
 import streamlit as st
 import os
+import uuid
 from datetime import datetime
 from dotenv import load_dotenv
 import sys
@@ -18,6 +20,9 @@ from faq_rag import get_rag_system
 # Load environment variables
 load_dotenv()
 
+# Send the app modules' log records to stderr
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 # Page configuration
 st.set_page_config(
     page_title="Medical Appointment Scheduler",
@@ -40,19 +45,6 @@ st.markdown("""
         color: #666;
         margin-bottom: 2rem;
     }
-    .chat-message {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin-bottom: 1rem;
-    }
-    .user-message {
-        background-color: #e3f2fd;
-        border-left: 4px solid #1f77b4;
-    }
-    .assistant-message {
-        background-color: #f5f5f5;
-        border-left: 4px solid #4caf50;
-    }
     .info-box {
         background-color: #fff3cd;
         border: 1px solid #ffc107;
@@ -83,6 +75,18 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+@st.cache_resource(show_spinner="Initializing AI agent...")
+def get_shared_agent():
+    """Create the agent once per process and share it across sessions and reruns"""
+    return create_agent()
+
+
+@st.cache_resource(show_spinner="Loading clinic knowledge base...")
+def get_shared_rag_system():
+    """Load the knowledge base once per process and share it across sessions and reruns"""
+    return get_rag_system()
+
+
 def initialize_session_state():
     """Initialize session state variables"""
     if "messages" not in st.session_state:
@@ -93,44 +97,29 @@ def initialize_session_state():
         })
     
     if "agent" not in st.session_state:
-        with st.spinner("Initializing AI agent..."):
-            try:
-                st.session_state.agent = create_agent()
-                st.success("✓ Agent initialized successfully!")
-            except Exception as e:
-                st.error(f"Error initializing agent: {e}")
-                st.stop()
+        try:
+            st.session_state.agent = get_shared_agent()
+        except Exception as e:
+            st.error(f"Error initializing agent: {e}")
+            st.stop()
     
     if "session_id" not in st.session_state:
-        st.session_state.session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        # The agent is shared, so session ids must be unique across browser sessions
+        st.session_state.session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
     
     if "rag_initialized" not in st.session_state:
-        with st.spinner("Loading clinic knowledge base..."):
-            try:
-                st.session_state.rag_system = get_rag_system()
-                st.session_state.rag_initialized = True
-                st.success("✓ Knowledge base loaded!")
-            except Exception as e:
-                st.error(f"Error loading knowledge base: {e}")
-                st.session_state.rag_initialized = False
+        try:
+            st.session_state.rag_system = get_shared_rag_system()
+            st.session_state.rag_initialized = True
+        except Exception as e:
+            st.error(f"Error loading knowledge base: {e}")
+            st.session_state.rag_initialized = False
 
 
 def display_message(role: str, content: str):
-    """Display a chat message with appropriate styling"""
-    if role == "user":
-        st.markdown(f"""
-        <div class="chat-message user-message">
-            <strong>You:</strong><br>
-            {content}
-        </div>
-        """, unsafe_allow_html=True)
-    else:
-        st.markdown(f"""
-        <div class="chat-message assistant-message">
-            <strong>🏥 Assistant:</strong><br>
-            {content}
-        </div>
-        """, unsafe_allow_html=True)
+    """Display a chat message in a chat bubble"""
+    with st.chat_message(role, avatar="🏥" if role == "assistant" else None):
+        st.markdown(content)
 
 
 def main():
@@ -238,36 +227,23 @@ def main():
         with chat_container:
             display_message("user", user_input)
         
-        # Get agent response
-        with st.spinner("Thinking..."):
-            try:
-                response = st.session_state.agent.chat(
+        # Stream agent response as it is generated
+        try:
+            with chat_container, st.chat_message("assistant", avatar="🏥"):
+                response = st.write_stream(st.session_state.agent.astream(
                     user_input,
                     session_id=st.session_state.session_id
-                )
-                
-                # Add assistant message to history
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": response
-                })
-                
-                # Display assistant message
-                with chat_container:
-                    display_message("assistant", response)
-                
-            except Exception as e:
-                error_message = f"I apologize, but I encountered an error: {str(e)}. Please try again or call our office at +1-555-123-4567."
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_message
-                })
-                
-                with chat_container:
-                    display_message("assistant", error_message)
+                ))
+        except Exception as e:
+            response = f"I apologize, but I encountered an error: {str(e)}. Please try again or call our office at +1-555-123-4567."
+            with chat_container:
+                display_message("assistant", response)
         
-        # Force rerun to update chat display
-        st.rerun()
+        # Add assistant message to history; the next chat input reruns the script
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": response
+        })
 
 
 if __name__ == "__main__":
@@ -3,16 +3,209 @@ RAG (Retrieval Augmented Generation) Implementation
 Uses ChromaDB for vector storage and retrieval of clinic FAQ information
 """
 
+import hashlib
 import json
+import logging
 import os
-from typing import List, Dict, Optional
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Iterator, Optional, Tuple
 from pathlib import Path
 
+import numpy as np
+import orjson
 import chromadb
+from chromadb.api.types import Documents, EmbeddingFunction
 from chromadb.config import Settings
+from langchain_core.embeddings import Embeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Context returned when a search finds nothing; compare by identity
+NO_RESULTS_CONTEXT = "No relevant information found in the knowledge base."
+
+# Maximum number of formatted contexts kept by the exact-match query cache
+CONTEXT_CACHE_SIZE = 512
+
+# Semantic cache: number of recent query embeddings kept, and the cosine
+# similarity above which a cached result is reused for a paraphrased query
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_CACHE_THRESHOLD = 0.95
+
+
+class _SemanticCache:
+    """Small LRU of query embeddings and their search results"""
+    
+    def __init__(self, size: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.size = size
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.clear()
+    
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._vectors: Optional[np.ndarray] = None
+            self._n_results = np.zeros(self.size, dtype=np.int32)
+            self._last_used = np.zeros(self.size, dtype=np.int64)
+            self._values: List[List[Dict]] = []
+            self._tick = 0
+    
+    def lookup(self, query_embedding: np.ndarray, n_results: int) -> Optional[List[Dict]]:
+        """Return cached results for a near-identical query, if any"""
+        with self._lock:
+            count = len(self._values)
+            if count == 0:
+                return None
+            
+            # Embeddings are L2-normalized, so the dot product is the cosine similarity
+            sims = self._vectors[:count] @ query_embedding
+            sims[self._n_results[:count] != n_results] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            
+            self._tick += 1
+            self._last_used[best] = self._tick
+            return self._values[best]
+    
+    def store(self, query_embedding: np.ndarray, n_results: int, results: List[Dict]):
+        """Cache results for a query, evicting the least recently used entry when full"""
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.size, query_embedding.shape[0]), dtype=np.float32)
+            
+            if len(self._values) < self.size:
+                slot = len(self._values)
+                self._values.append(results)
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._values[slot] = results
+            
+            self._vectors[slot] = query_embedding
+            self._n_results[slot] = n_results
+            self._tick += 1
+            self._last_used[slot] = self._tick
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """
+    MiniLM sentence embeddings served by ONNX Runtime
+    
+    Intended for a quantized (e.g. INT8) ONNX export of all-MiniLM-L6-v2.
+    Produces the same mean-pooled, L2-normalized vectors as the
+    HuggingFace pipeline without the PyTorch runtime overhead.
+    """
+    
+    def __init__(
+        self,
+        model_path: str,
+        tokenizer_name: str = EMBEDDING_MODEL_NAME,
+        batch_size: int = 64,
+        max_length: int = 256
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = os.cpu_count() or 1
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        self.batch_size = batch_size
+        self.max_length = max_length
+    
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in batches: tokenize, run the model, mean-pool, normalize"""
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            feeds = {
+                name: value.astype(np.int64)
+                for name, value in encoded.items()
+                if name in self.input_names
+            }
+            token_embeddings = self.session.run(None, feeds)[0]
+            
+            # Mean pooling over non-padding tokens
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings.extend(pooled.tolist())
+        
+        return embeddings
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents"""
+        return self._embed(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self._embed([text])[0]
+
+
+def create_embeddings() -> Embeddings:
+    """
+    Create the embeddings model
+    
+    Uses the ONNX Runtime model at EMBEDDING_ONNX_PATH when configured and
+    onnxruntime is installed, otherwise the HuggingFace (PyTorch) model.
+    """
+    onnx_path = os.getenv("EMBEDDING_ONNX_PATH")
+    if onnx_path:
+        try:
+            return OnnxMiniLMEmbeddings(onnx_path)
+        except ImportError as e:
+            logger.warning("ONNX embeddings unavailable (%s), falling back to HuggingFace", e)
+    
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+
+
+class LangChainEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Expose a LangChain embeddings model as a ChromaDB embedding function"""
+    
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+    
+    def __call__(self, input: Documents) -> List[List[float]]:
+        return self.embeddings.embed_documents(list(input))
+
+
+_CHROMA_CLIENTS: Dict[str, "chromadb.ClientAPI"] = {}
+_CHROMA_LOCK = threading.Lock()
+
+
+def get_chroma_client(chroma_db_path: str) -> "chromadb.ClientAPI":
+    """Get or create the persistent ChromaDB client for a database path"""
+    with _CHROMA_LOCK:
+        client = _CHROMA_CLIENTS.get(chroma_db_path)
+        if client is None:
+            client = chromadb.PersistentClient(
+                path=chroma_db_path,
+                settings=Settings(anonymized_telemetry=False)
+            )
+            _CHROMA_CLIENTS[chroma_db_path] = client
+        return client
+
 
 class FAQRagSystem:
     """RAG system for clinic FAQ information"""
@@ -27,49 +220,95 @@ class FAQRagSystem:
         self.chroma_db_path = chroma_db_path
         self.collection_name = collection_name
         
-        # Initialize embeddings model
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Exact-match cache of formatted contexts, keyed on (normalized query, n_results)
+        self._context_cache: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._context_lock = threading.Lock()
+        
+        # Embedding-similarity cache so paraphrased queries skip the vector search
+        self._semantic_cache = _SemanticCache()
+        
+        # Initialize embeddings model, shared with ChromaDB for indexing documents
+        self.embeddings = create_embeddings()
+        self.embedding_function = LangChainEmbeddingFunction(self.embeddings)
         
         # Initialize ChromaDB
-        self.client = chromadb.PersistentClient(
-            path=self.chroma_db_path,
-            settings=Settings(anonymized_telemetry=False)
-        )
+        self.client = get_chroma_client(self.chroma_db_path)
         
-        # Get or create collection
+        # Get the collection, rebuilding it only when clinic info has changed
         try:
-            self.collection = self.client.get_collection(name=self.collection_name)
-            print(f"Loaded existing collection: {self.collection_name}")
+            raw = self._read_clinic_info()
+        except FileNotFoundError:
+            raw = None
+        try:
+            self.collection = self.client.get_collection(
+                name=self.collection_name,
+                embedding_function=self.embedding_function
+            )
         except Exception:
-            self.collection = self.client.create_collection(name=self.collection_name)
-            print(f"Created new collection: {self.collection_name}")
-            self._initialize_knowledge_base()
-    
-    def _initialize_knowledge_base(self):
-        """Load and index clinic information"""
-        print("Initializing knowledge base...")
+            self.collection = None
         
-        # Load clinic info
-        with open(self.clinic_info_path, 'r') as f:
-            clinic_data = json.load(f)
+        if raw is None:
+            # Without the source file the persisted collection is all there is
+            if self.collection is None:
+                logger.error("Clinic info file not found and no existing collection: %s", self.clinic_info_path)
+                raise FileNotFoundError(self.clinic_info_path)
+            self.source_hash = (self.collection.metadata or {}).get("src_hash")
+            logger.warning(
+                "Clinic info file not found (%s), using existing collection: %s",
+                self.clinic_info_path, self.collection_name
+            )
+        elif self.collection is not None and self.collection.metadata == self._collection_metadata():
+            logger.info("Loaded existing collection: %s", self.collection_name)
+        else:
+            self._build_collection(raw)
+            logger.info("Created new collection: %s", self.collection_name)
+    
+    def _read_clinic_info(self) -> bytes:
+        """Read the clinic info file and record its content hash"""
+        raw = Path(self.clinic_info_path).read_bytes()
+        self.source_hash = hashlib.sha256(raw).hexdigest()
+        return raw
+    
+    def _collection_metadata(self) -> Dict:
+        """Collection metadata: source data hash plus HNSW index settings"""
+        return {
+            "src_hash": self.source_hash,
+            # Embeddings are L2-normalized, so cosine matches the embedding geometry;
+            # a small graph is near-exact for a few hundred FAQ chunks
+            "hnsw:space": "cosine",
+            "hnsw:M": 16,
+            "hnsw:construction_ef": 100,
+            "hnsw:search_ef": 40,
+        }
+    
+    def _build_collection(self, raw: bytes, reuse_embeddings: bool = True):
+        """(Re)create the collection, reusing embeddings of unchanged chunks"""
+        previous_embeddings = {}
+        if self.collection is not None:
+            if reuse_embeddings:
+                existing = self.collection.get(include=["embeddings"])
+                previous_embeddings = dict(zip(existing["ids"], existing["embeddings"]))
+            self.client.delete_collection(name=self.collection_name)
         
-        # Convert structured data to text documents
-        documents = []
-        metadatas = []
+        self.collection = self.client.create_collection(
+            name=self.collection_name,
+            embedding_function=self.embedding_function,
+            metadata=self._collection_metadata()
+        )
+        self._initialize_knowledge_base(raw, previous_embeddings)
+    
+    def _initialize_knowledge_base(self, raw: bytes, previous_embeddings: Optional[Dict] = None):
+        """Load and index clinic information"""
+        logger.info("Initializing knowledge base...")
+        previous_embeddings = previous_embeddings or {}
         
-        # Process each section
-        for section_name, section_data in clinic_data.items():
-            docs, metas = self._process_section(section_name, section_data)
-            documents.extend(docs)
-            metadatas.extend(metas)
+        # Load clinic info (raw bytes are shared with the content hash)
+        clinic_data = orjson.loads(raw)
         
         # Split documents into chunks
+        chunk_size = 500
         text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
+            chunk_size=chunk_size,
             chunk_overlap=50,
             length_function=len,
             separators=["\n\n", "\n", ". ", " ", ""]
@@ -77,107 +316,109 @@ class FAQRagSystem:
         
         split_documents = []
         split_metadatas = []
+        ids = []
+        seen_ids = set()
         
-        for doc, meta in zip(documents, metadatas):
-            chunks = text_splitter.split_text(doc)
-            for chunk in chunks:
-                split_documents.append(chunk)
-                split_metadatas.append(meta)
+        # Convert each section of structured data to text documents and chunk them
+        for section_name, section_data in clinic_data.items():
+            for doc, meta in self._process_section(section_name, section_data):
+                # Most documents are short one-liners that are already a single chunk
+                chunks = [doc] if len(doc) <= chunk_size else text_splitter.split_text(doc)
+                for chunk in chunks:
+                    # Content-addressed ids let unchanged chunks keep their embeddings
+                    chunk_id = hashlib.blake2b(chunk.encode(), digest_size=8).hexdigest()
+                    if chunk_id in seen_ids:
+                        continue
+                    seen_ids.add(chunk_id)
+                    split_documents.append(chunk)
+                    split_metadatas.append(meta)
+                    ids.append(chunk_id)
         
         # Generate embeddings and add to ChromaDB
-        print(f"Adding {len(split_documents)} document chunks to vector store...")
+        logger.info("Adding %d document chunks to vector store...", len(split_documents))
         
-        # Generate embeddings
-        embeddings_list = self.embeddings.embed_documents(split_documents)
+        # Chunks that were already indexed keep their stored embeddings
+        reused = [i for i, chunk_id in enumerate(ids) if chunk_id in previous_embeddings]
+        missing = [i for i, chunk_id in enumerate(ids) if chunk_id not in previous_embeddings]
         
-        # Add to ChromaDB
-        ids = [f"doc_{i}" for i in range(len(split_documents))]
+        if reused:
+            self.collection.upsert(
+                documents=[split_documents[i] for i in reused],
+                embeddings=[
+                    np.asarray(previous_embeddings[ids[i]], dtype=np.float32).tolist() for i in reused
+                ],
+                metadatas=[split_metadatas[i] for i in reused],
+                ids=[ids[i] for i in reused]
+            )
         
-        self.collection.add(
-            documents=split_documents,
-            embeddings=embeddings_list,
-            metadatas=split_metadatas,
-            ids=ids
-        )
+        # New chunks are embedded by the collection's embedding function
+        if missing:
+            self.collection.upsert(
+                documents=[split_documents[i] for i in missing],
+                metadatas=[split_metadatas[i] for i in missing],
+                ids=[ids[i] for i in missing]
+            )
         
-        print(f"Knowledge base initialized with {len(split_documents)} chunks")
+        logger.info(
+            "Knowledge base initialized with %d chunks (%d embedded, %d reused)",
+            len(split_documents), len(missing), len(reused)
+        )
     
-    def _process_section(self, section_name: str, section_data) -> tuple:
-        """Process a section of clinic data into documents"""
-        documents = []
-        metadatas = []
-        
+    def _process_section(self, section_name: str, section_data) -> Iterator[Tuple[str, Dict]]:
+        """Process a section of clinic data into (document, metadata) pairs"""
         if isinstance(section_data, dict):
+            section_title = section_name.replace('_', ' ').title()
+            
             # Handle nested dictionaries
             for key, value in section_data.items():
+                key_title = key.replace('_', ' ').title()
+                
                 if isinstance(value, (str, int, float)):
-                    doc = f"{section_name.replace('_', ' ').title()} - {key.replace('_', ' ').title()}: {value}"
-                    documents.append(doc)
-                    metadatas.append({
+                    yield f"{section_title} - {key_title}: {value}", {
                         "section": section_name,
                         "subsection": key,
                         "type": "info"
-                    })
+                    }
                 elif isinstance(value, list):
                     if key == "accepted_insurance":
                         doc = f"Accepted Insurance: We accept {', '.join(value)}"
-                        documents.append(doc)
-                        metadatas.append({
-                            "section": section_name,
-                            "subsection": key,
-                            "type": "list"
-                        })
                     elif key == "payment_methods":
                         doc = f"Payment Methods: We accept {', '.join(value)}"
-                        documents.append(doc)
-                        metadatas.append({
-                            "section": section_name,
-                            "subsection": key,
-                            "type": "list"
-                        })
                     else:
-                        doc = f"{key.replace('_', ' ').title()}: {', '.join(str(item) for item in value)}"
-                        documents.append(doc)
-                        metadatas.append({
-                            "section": section_name,
-                            "subsection": key,
-                            "type": "list"
-                        })
+                        doc = f"{key_title}: {', '.join(str(item) for item in value)}"
+                    yield doc, {
+                        "section": section_name,
+                        "subsection": key,
+                        "type": "list"
+                    }
                 elif isinstance(value, dict):
                     # Handle nested objects (like appointment types)
                     for sub_key, sub_value in value.items():
                         if isinstance(sub_value, dict):
-                            doc_parts = [f"{key.replace('_', ' ').title()} - {sub_key.replace('_', ' ').title()}"]
-                            for k, v in sub_value.items():
-                                doc_parts.append(f"{k.replace('_', ' ').title()}: {v}")
-                            doc = "\n".join(doc_parts)
-                            documents.append(doc)
-                            metadatas.append({
+                            doc_parts = [f"{key_title} - {sub_key.replace('_', ' ').title()}"]
+                            doc_parts.extend(
+                                f"{k.replace('_', ' ').title()}: {v}" for k, v in sub_value.items()
+                            )
+                            yield "\n".join(doc_parts), {
                                 "section": section_name,
                                 "subsection": key,
                                 "item": sub_key,
                                 "type": "nested_info"
-                            })
+                            }
         elif isinstance(section_data, list):
             # Handle lists (like FAQs)
             for item in section_data:
                 if isinstance(item, dict):
                     if "question" in item and "answer" in item:
-                        doc = f"Q: {item['question']}\nA: {item['answer']}"
-                        documents.append(doc)
-                        metadatas.append({
+                        yield f"Q: {item['question']}\nA: {item['answer']}", {
                             "section": section_name,
                             "type": "faq"
-                        })
+                        }
                     else:
-                        doc = json.dumps(item, indent=2)
-                        documents.append(doc)
-                        metadatas.append({
+                        yield json.dumps(item, indent=2), {
                             "section": section_name,
                             "type": "structured_data"
-                        })
-        
-        return documents, metadatas
+                        }
     
     def search(self, query: str, n_results: int = 3) -> List[Dict]:
         """
@@ -192,12 +433,18 @@ class FAQRagSystem:
         """
         try:
             # Generate query embedding
-            query_embedding = self.embeddings.embed_query(query)
+            query_embedding = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            
+            # Reuse results of a previous, near-identical query
+            cached = self._semantic_cache.lookup(query_embedding, n_results)
+            if cached is not None:
+                return cached
             
             # Search in ChromaDB
             results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results
+                query_embeddings=[query_embedding.tolist()],
+                n_results=n_results,
+                include=["documents", "metadatas", "distances"]
             )
             
             # Format results
@@ -210,10 +457,13 @@ class FAQRagSystem:
                         "distance": results['distances'][0][i] if results['distances'] else 0
                     })
             
+            if formatted_results:
+                self._semantic_cache.store(query_embedding, n_results, formatted_results)
+            
             return formatted_results
             
-        except Exception as e:
-            print(f"Error searching FAQ: {e}")
+        except Exception:
+            logger.exception("Error searching FAQ")
             return []
     
     def get_context_for_query(self, query: str, n_results: int = 3) -> str:
@@ -227,29 +477,54 @@ class FAQRagSystem:
         Returns:
             Formatted context string
         """
+        # Repeated questions (e.g. the sidebar examples) skip embedding + vector search
+        cache_key = (" ".join(query.lower().split()), n_results)
+        with self._context_lock:
+            cached = self._context_cache.get(cache_key)
+            if cached is not None:
+                self._context_cache.move_to_end(cache_key)
+                return cached
+        
         results = self.search(query, n_results)
         
         if not results:
-            return "No relevant information found in the knowledge base."
+            return NO_RESULTS_CONTEXT
         
         context_parts = []
         for i, result in enumerate(results, 1):
             context_parts.append(f"[Source {i}]\n{result['content']}")
         
-        return "\n\n".join(context_parts)
+        context = "\n\n".join(context_parts)
+        
+        with self._context_lock:
+            self._context_cache[cache_key] = context
+            if len(self._context_cache) > CONTEXT_CACHE_SIZE:
+                self._context_cache.popitem(last=False)
+        
+        return context
     
     def reset_knowledge_base(self):
         """Delete and reinitialize the knowledge base"""
         try:
-            self.client.delete_collection(name=self.collection_name)
-            self.collection = self.client.create_collection(name=self.collection_name)
-            self._initialize_knowledge_base()
-            print("Knowledge base reset successfully")
-        except Exception as e:
-            print(f"Error resetting knowledge base: {e}")
+            with self._context_lock:
+                self._context_cache.clear()
+            self._semantic_cache.clear()
+            self._build_collection(self._read_clinic_info(), reuse_embeddings=False)
+            logger.info("Knowledge base reset successfully")
+        except Exception:
+            logger.exception("Error resetting knowledge base")
 
 
 # Global instance
+_RAG_SYSTEM: Optional[FAQRagSystem] = None
+_RAG_LOCK = threading.Lock()
+
+
 def get_rag_system() -> FAQRagSystem:
-    """Get or create RAG system instance"""
-    return FAQRagSystem()
+    """Get or create the shared RAG system instance"""
+    global _RAG_SYSTEM
+    if _RAG_SYSTEM is None:
+        with _RAG_LOCK:
+            if _RAG_SYSTEM is None:
+                _RAG_SYSTEM = FAQRagSystem()
+    return _RAG_SYSTEM
@@ -3,54 +3,230 @@ Mock Calendly API Implementation
 Simulates Calendly API endpoints for appointment scheduling
 """
 
-import json
+import logging
 import os
-from datetime import datetime, timedelta, time as dt_time
-from typing import List, Dict, Optional
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time
+from typing import List, Dict, Optional, Tuple
 import uuid
 from pathlib import Path
 
+import numpy as np
+import orjson
+
 from schemas import (
     AppointmentRequest,
     AppointmentResponse,
     AvailabilityRequest,
     AvailabilityResponse,
+    BookingStatus,
     TimeSlot,
-    APPOINTMENT_TYPES
+    APPOINTMENT_DURATIONS,
+    format_timestamp
 )
 
+logger = logging.getLogger(__name__)
+
+
+# Business hours (9 AM to 5 PM) in minutes since midnight, and the slot increment
+BUSINESS_START_MINUTES = 9 * 60
+BUSINESS_END_MINUTES = 17 * 60
+SLOT_INCREMENT_MINUTES = 15
+
+
+def _to_minutes(hhmm: str) -> int:
+    """Convert an HH:MM time to minutes since midnight"""
+    h, m = hhmm.split(':')
+    return int(h) * 60 + int(m)
+
+
+def _format_minutes(minutes: int) -> str:
+    """Convert minutes since midnight to an HH:MM time"""
+    return "%02d:%02d" % divmod(minutes, 60)
+
+
+def _minutes_to_time(minutes: int) -> time:
+    """Convert minutes since midnight to a time"""
+    return time(*divmod(minutes, 60))
+
+
+# Start minutes of every slot of each appointment type that fits in business hours
+_SLOT_STARTS_BY_TYPE: Dict[str, np.ndarray] = {
+    appointment_type: np.arange(
+        BUSINESS_START_MINUTES,
+        BUSINESS_END_MINUTES - duration + 1,
+        SLOT_INCREMENT_MINUTES,
+        dtype=np.int32
+    )
+    for appointment_type, duration in APPOINTMENT_DURATIONS.items()
+}
+
+# The matching TimeSlot of every grid entry; TimeSlot is frozen, so responses share them
+_SLOTS_BY_TYPE: Dict[str, Tuple[TimeSlot, ...]] = {
+    appointment_type: tuple(
+        TimeSlot(
+            start_time=_minutes_to_time(start),
+            end_time=_minutes_to_time(start + APPOINTMENT_DURATIONS[appointment_type])
+        )
+        for start in starts.tolist()
+    )
+    for appointment_type, starts in _SLOT_STARTS_BY_TYPE.items()
+}
+
+
+def _appointment_response(**fields) -> AppointmentResponse:
+    """Build a response from values the calendar produced (validated only when assertions are on)"""
+    if __debug__:
+        return AppointmentResponse(**fields)
+    return AppointmentResponse.model_construct(**fields)
+
+
+class SQLiteCalendlyStore:
+    """
+    SQLite storage for appointments
+    
+    Each appointment is one row: the full record as JSON plus the columns
+    needed to look it up (date, status and start/end minutes since midnight).
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS appointments (
+            booking_id TEXT PRIMARY KEY,
+            date TEXT NOT NULL,
+            start_min INTEGER NOT NULL,
+            end_min INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_appointments_date_status ON appointments (date, status);
+    """
+    
+    def __init__(self, db_file: str, legacy_json_file: Optional[str] = None):
+        os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+        # One connection shared by all threads, serialized by the lock
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+            if legacy_json_file:
+                self._migrate_json(legacy_json_file)
+    
+    def _migrate_json(self, json_file: str):
+        """Copy appointments from the old JSON file into an empty database"""
+        if not os.path.exists(json_file):
+            return
+        if self._conn.execute("SELECT 1 FROM appointments LIMIT 1").fetchone():
+            return
+        try:
+            with open(json_file, 'rb') as f:
+                appointments = orjson.loads(f.read()).get("appointments", [])
+            with self.transaction():
+                for appt in appointments:
+                    self.insert(appt, or_ignore=True)
+            logger.info("Migrated %d appointments from %s", len(appointments), json_file)
+        except Exception:
+            logger.exception("Error migrating appointments from %s", json_file)
+    
+    @contextmanager
+    def transaction(self):
+        """Run the block in a single write transaction (nested blocks join the outer one)"""
+        with self._lock:
+            outermost = self._transaction_depth == 0
+            if outermost:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._transaction_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._transaction_depth -= 1
+                if outermost:
+                    self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._transaction_depth -= 1
+                if outermost:
+                    self._conn.execute("COMMIT")
+    
+    def booked_intervals(self, date: str) -> List[Tuple[int, int]]:
+        """Sorted (start, end) minutes of the confirmed appointments on a date"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT start_min, end_min FROM appointments "
+                "WHERE date = ? AND status = 'confirmed' ORDER BY start_min, end_min",
+                (date,)
+            ).fetchall()
+    
+    def has_overlap(self, date: str, start_min: int, end_min: int) -> bool:
+        """Check whether a confirmed appointment on the date overlaps [start_min, end_min)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM appointments "
+                "WHERE date = ? AND status = 'confirmed' AND start_min < ? AND end_min > ? LIMIT 1",
+                (date, end_min, start_min)
+            ).fetchone() is not None
+    
+    def get(self, booking_id: str) -> Optional[Dict]:
+        """Get an appointment record by booking ID"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM appointments WHERE booking_id = ?", (booking_id,)
+            ).fetchone()
+        return orjson.loads(row[0]) if row else None
+    
+    def insert(self, appointment: Dict, or_ignore: bool = False):
+        """Store a new appointment record"""
+        verb = "INSERT OR IGNORE" if or_ignore else "INSERT"
+        with self._lock:
+            self._conn.execute(
+                f"{verb} INTO appointments (booking_id, date, start_min, end_min, status, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    appointment["booking_id"],
+                    appointment["date"],
+                    _to_minutes(appointment["start_time"]),
+                    _to_minutes(appointment["end_time"]),
+                    appointment["status"],
+                    orjson.dumps(appointment).decode()
+                )
+            )
+    
+    def update(self, appointment: Dict):
+        """Overwrite an existing appointment record (e.g. after a status change)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE appointments SET status = ?, payload = ? WHERE booking_id = ?",
+                (appointment["status"], orjson.dumps(appointment).decode(), appointment["booking_id"])
+            )
+
 
 class MockCalendlyAPI:
     """Mock implementation of Calendly API"""
     
-    def __init__(self, appointments_file: str = "data/appointments.json"):
+    def __init__(
+        self,
+        appointments_file: str = "data/appointments.json",
+        *,
+        db_file: Optional[str] = None
+    ):
+        # appointments_file is the old JSON storage, imported once into a new database
+        # stored next to it (appointments.db unless db_file is given)
         self.appointments_file = appointments_file
-        self._ensure_appointments_file()
-        
-    def _ensure_appointments_file(self):
-        """Ensure appointments file exists"""
-        os.makedirs(os.path.dirname(self.appointments_file), exist_ok=True)
-        if not os.path.exists(self.appointments_file):
-            with open(self.appointments_file, 'w') as f:
-                json.dump({"appointments": []}, f)
-    
-    def _load_appointments(self) -> List[Dict]:
-        """Load existing appointments"""
-        try:
-            with open(self.appointments_file, 'r') as f:
-                data = json.load(f)
-                return data.get("appointments", [])
-        except Exception as e:
-            print(f"Error loading appointments: {e}")
-            return []
+        if db_file is None:
+            db_file = str(Path(appointments_file).with_suffix(".db"))
+        self._store = SQLiteCalendlyStore(db_file, legacy_json_file=appointments_file)
     
-    def _save_appointments(self, appointments: List[Dict]):
-        """Save appointments to file"""
-        try:
-            with open(self.appointments_file, 'w') as f:
-                json.dump({"appointments": appointments}, f, indent=2)
-        except Exception as e:
-            print(f"Error saving appointments: {e}")
+    def batch(self):
+        """
+        Group several bookings/cancellations into a single transaction
+        
+        Other threads' writes wait until the batch is done.
+        """
+        return self._store.transaction()
     
     def get_availability(self, request: AvailabilityRequest) -> AvailabilityResponse:
         """
@@ -63,15 +239,18 @@ class MockCalendlyAPI:
             AvailabilityResponse with available slots
         """
         try:
-            # Parse the requested date
-            req_date = datetime.strptime(request.date, "%Y-%m-%d").date()
+            req_date = request.date
+            
+            # Read the clock once for the whole request
+            now = datetime.now()
+            today = now.date()
+            now_minutes = now.hour * 60 + now.minute
             
             # Check if date is in the past
-            if req_date < datetime.now().date():
+            if req_date < today:
                 return AvailabilityResponse(
                     date=request.date,
                     appointment_type=request.appointment_type,
-                    available_slots=[],
                     total_slots=0
                 )
             
@@ -80,94 +259,50 @@ class MockCalendlyAPI:
                 return AvailabilityResponse(
                     date=request.date,
                     appointment_type=request.appointment_type,
-                    available_slots=[],
                     total_slots=0
                 )
             
             # Get appointment duration
-            duration = APPOINTMENT_TYPES[request.appointment_type]["duration"]
+            duration = APPOINTMENT_DURATIONS[request.appointment_type]
             
-            # Generate time slots (9 AM to 5 PM)
-            business_start = dt_time(9, 0)
-            business_end = dt_time(17, 0)
+            # Load existing confirmed appointments for this date
+            booked_slots = self._store.booked_intervals(req_date.isoformat())
             
-            # Load existing appointments for this date
-            existing_appointments = self._load_appointments()
-            booked_slots = [
-                (appt["start_time"], appt["end_time"])
-                for appt in existing_appointments
-                if appt["date"] == request.date and appt["status"] == "confirmed"
-            ]
+            # Candidate start minutes (9 AM to 5 PM, 15-minute increments)
+            starts = _SLOT_STARTS_BY_TYPE[request.appointment_type]
+            available = np.ones(starts.shape, dtype=bool)
             
-            # Generate all possible slots
-            available_slots = []
-            current_time = datetime.combine(req_date, business_start)
-            end_time = datetime.combine(req_date, business_end)
+            # A slot overlaps a booking if, of the bookings starting before the slot ends,
+            # one ends after the slot starts (running max of ends handles overlapping bookings)
+            if booked_slots:
+                booked = np.array(booked_slots, dtype=np.int32)
+                booked_max_ends = np.maximum.accumulate(booked[:, 1])
+                i = np.searchsorted(booked[:, 0], starts + duration, side="left") - 1
+                available &= ~((i >= 0) & (booked_max_ends[np.maximum(i, 0)] > starts))
             
-            while current_time + timedelta(minutes=duration) <= end_time:
-                slot_start = current_time.strftime("%H:%M")
-                slot_end = (current_time + timedelta(minutes=duration)).strftime("%H:%M")
-                
-                # Check if slot overlaps with any booked appointment
-                is_available = not any(
-                    self._slots_overlap(slot_start, slot_end, booked_start, booked_end)
-                    for booked_start, booked_end in booked_slots
-                )
-                
-                # If it's today, check if the time has already passed
-                if req_date == datetime.now().date():
-                    current_hour = datetime.now().hour
-                    current_minute = datetime.now().minute
-                    slot_hour, slot_minute = map(int, slot_start.split(':'))
-                    
-                    if (slot_hour < current_hour) or (slot_hour == current_hour and slot_minute <= current_minute):
-                        is_available = False
-                
-                available_slots.append(
-                    TimeSlot(
-                        start_time=slot_start,
-                        end_time=slot_end,
-                        available=is_available
-                    )
-                )
-                
-                # Move to next slot (15-minute increments)
-                current_time += timedelta(minutes=15)
+            # If it's today, times that have already passed are unavailable
+            if req_date == today:
+                available &= starts > now_minutes
             
-            # Filter to only available slots
-            available_only = [slot for slot in available_slots if slot.available]
+            # Share the precomputed TimeSlot grid; bit i of the mask marks slot i available
+            available_mask = int.from_bytes(np.packbits(available, bitorder="little").tobytes(), "little")
             
             return AvailabilityResponse(
                 date=request.date,
                 appointment_type=request.appointment_type,
-                available_slots=available_only,
-                total_slots=len(available_only)
+                all_slots=_SLOTS_BY_TYPE[request.appointment_type],
+                available_mask=available_mask,
+                total_slots=int(np.count_nonzero(available))
             )
             
-        except Exception as e:
-            print(f"Error getting availability: {e}")
+        except Exception:
+            logger.exception("Error getting availability")
             return AvailabilityResponse(
                 date=request.date,
                 appointment_type=request.appointment_type,
-                available_slots=[],
                 total_slots=0
             )
     
-    def _slots_overlap(self, start1: str, end1: str, start2: str, end2: str) -> bool:
-        """Check if two time slots overlap"""
-        # Convert to minutes since midnight for easier comparison
-        def time_to_minutes(t: str) -> int:
-            h, m = map(int, t.split(':'))
-            return h * 60 + m
-        
-        s1 = time_to_minutes(start1)
-        e1 = time_to_minutes(end1)
-        s2 = time_to_minutes(start2)
-        e2 = time_to_minutes(end2)
-        
-        # Check overlap: start1 < end2 and start2 < end1
-        return s1 < e2 and s2 < e1
-    
     def book_appointment(self, request: AppointmentRequest) -> AppointmentResponse:
         """
         Book an appointment
@@ -178,78 +313,85 @@ class MockCalendlyAPI:
         Returns:
             AppointmentResponse with confirmation
         """
+        # The overlap check and the insert must not interleave with other bookings
+        with self._store.transaction():
+            return self._book_appointment(request)
+    
+    def _book_appointment(self, request: AppointmentRequest) -> AppointmentResponse:
+        """Book an appointment; caller must hold a store transaction"""
         try:
+            # Read the clock once for the whole booking
+            now = datetime.now()
+            today = now.date()
+            
             # Validate the date
-            req_date = datetime.strptime(request.appointment_date, "%Y-%m-%d").date()
+            req_date = request.appointment_date
+            date_str = req_date.isoformat()
             
-            if req_date < datetime.now().date():
-                return AppointmentResponse(
+            if req_date < today:
+                return _appointment_response(
                     booking_id="",
-                    status="failed",
+                    status=BookingStatus.FAILED,
                     confirmation_code="",
                     appointment_type=request.appointment_type,
                     date=request.appointment_date,
                     start_time=request.start_time,
-                    end_time="",
+                    end_time=None,
                     patient_name=request.patient.name,
                     patient_email=request.patient.email,
-                    reason="Cannot book appointments in the past",
-                    created_at=datetime.now().isoformat()
+                    reason="Cannot book appointments in the past"
                 )
             
             # Check if weekend
             if req_date.weekday() >= 5:
-                return AppointmentResponse(
+                return _appointment_response(
                     booking_id="",
-                    status="failed",
+                    status=BookingStatus.FAILED,
                     confirmation_code="",
                     appointment_type=request.appointment_type,
                     date=request.appointment_date,
                     start_time=request.start_time,
-                    end_time="",
+                    end_time=None,
                     patient_name=request.patient.name,
                     patient_email=request.patient.email,
-                    reason="Clinic is closed on weekends",
-                    created_at=datetime.now().isoformat()
+                    reason="Clinic is closed on weekends"
                 )
             
-            # Calculate end time
-            duration = APPOINTMENT_TYPES[request.appointment_type]["duration"]
-            start_dt = datetime.strptime(request.start_time, "%H:%M")
-            end_dt = start_dt + timedelta(minutes=duration)
-            end_time = end_dt.strftime("%H:%M")
+            # Calculate end time (minutes since midnight)
+            duration = APPOINTMENT_DURATIONS[request.appointment_type]
+            start_min = request.start_time.hour * 60 + request.start_time.minute
+            end_min = start_min + duration
             
-            # Check availability
-            availability_req = AvailabilityRequest(
-                date=request.appointment_date,
-                appointment_type=request.appointment_type
-            )
-            availability = self.get_availability(availability_req)
-            
-            # Verify the requested slot is available
-            is_slot_available = any(
-                slot.start_time == request.start_time and slot.available
-                for slot in availability.available_slots
+            # Verify the requested slot is on the slot grid, not already past, and free
+            is_slot_available = (
+                BUSINESS_START_MINUTES <= start_min
+                and end_min <= BUSINESS_END_MINUTES
+                and (start_min - BUSINESS_START_MINUTES) % SLOT_INCREMENT_MINUTES == 0
+                and (req_date != today or start_min > now.hour * 60 + now.minute)
+                and not self._store.has_overlap(date_str, start_min, end_min)
             )
             
             if not is_slot_available:
-                return AppointmentResponse(
+                return _appointment_response(
                     booking_id="",
-                    status="failed",
+                    status=BookingStatus.FAILED,
                     confirmation_code="",
                     appointment_type=request.appointment_type,
                     date=request.appointment_date,
                     start_time=request.start_time,
-                    end_time=end_time,
+                    end_time=None,
                     patient_name=request.patient.name,
                     patient_email=request.patient.email,
-                    reason="Time slot is not available",
-                    created_at=datetime.now().isoformat()
+                    reason="Time slot is not available"
                 )
             
             # Generate booking details
-            booking_id = f"APPT-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
-            confirmation_code = str(uuid.uuid4())[:6].upper()
+            # (one random UUID supplies both the booking ID suffix and the confirmation code)
+            u = uuid.uuid4().hex.upper()
+            booking_id = f"APPT-{today.isoformat().replace('-', '')}-{u[:8]}"
+            confirmation_code = u[8:14]
+            # Stored record and response carry the same creation time, in the same format
+            created_at_ts = int(now.timestamp())
             
             # Create appointment record
             appointment = {
@@ -257,9 +399,9 @@ class MockCalendlyAPI:
                 "confirmation_code": confirmation_code,
                 "status": "confirmed",
                 "appointment_type": request.appointment_type,
-                "date": request.appointment_date,
-                "start_time": request.start_time,
-                "end_time": end_time,
+                "date": date_str,
+                "start_time": _format_minutes(start_min),
+                "end_time": _format_minutes(end_min),
                 "duration_minutes": duration,
                 "patient": {
                     "name": request.patient.name,
@@ -267,66 +409,70 @@ class MockCalendlyAPI:
                     "phone": request.patient.phone
                 },
                 "reason": request.reason,
-                "created_at": datetime.now().isoformat()
+                "created_at": format_timestamp(created_at_ts)
             }
             
             # Save appointment
-            appointments = self._load_appointments()
-            appointments.append(appointment)
-            self._save_appointments(appointments)
+            self._store.insert(appointment)
             
-            return AppointmentResponse(
+            return _appointment_response(
                 booking_id=booking_id,
-                status="confirmed",
+                status=BookingStatus.CONFIRMED,
                 confirmation_code=confirmation_code,
                 appointment_type=request.appointment_type,
                 date=request.appointment_date,
                 start_time=request.start_time,
-                end_time=end_time,
+                end_time=_minutes_to_time(end_min),
                 patient_name=request.patient.name,
                 patient_email=request.patient.email,
                 reason=request.reason,
-                created_at=appointment["created_at"]
+                created_at_ts=created_at_ts
             )
             
         except Exception as e:
-            print(f"Error booking appointment: {e}")
-            return AppointmentResponse(
+            logger.exception("Error booking appointment")
+            return _appointment_response(
                 booking_id="",
-                status="failed",
+                status=BookingStatus.FAILED,
                 confirmation_code="",
                 appointment_type=request.appointment_type,
                 date=request.appointment_date,
                 start_time=request.start_time,
-                end_time="",
+                end_time=None,
                 patient_name=request.patient.name,
                 patient_email=request.patient.email,
-                reason=f"Booking failed: {str(e)}",
-                created_at=datetime.now().isoformat()
+                reason=f"Booking failed: {str(e)}"
             )
     
     def get_booking(self, booking_id: str) -> Optional[Dict]:
         """Get booking details by ID"""
-        appointments = self._load_appointments()
-        for appt in appointments:
-            if appt["booking_id"] == booking_id:
-                return appt
-        return None
+        return self._store.get(booking_id)
     
     def cancel_appointment(self, booking_id: str) -> bool:
         """Cancel an appointment"""
         try:
-            appointments = self._load_appointments()
-            for appt in appointments:
-                if appt["booking_id"] == booking_id:
-                    appt["status"] = "cancelled"
-                    self._save_appointments(appointments)
-                    return True
-            return False
-        except Exception as e:
-            print(f"Error cancelling appointment: {e}")
+            with self._store.transaction():
+                appt = self._store.get(booking_id)
+                if appt is None:
+                    return False
+                appt["status"] = "cancelled"
+                self._store.update(appt)
+                return True
+        except Exception:
+            logger.exception("Error cancelling appointment")
             return False
 
 
-# Global instance
-calendly_api = MockCalendlyAPI()
+# Global instance, created on first use rather than at import
+_CALENDLY_API: Optional[MockCalendlyAPI] = None
+_CALENDLY_LOCK = threading.Lock()
+
+
+def get_calendly_api() -> MockCalendlyAPI:
+    """Get or create the shared calendar instance"""
+    global _CALENDLY_API
+    if _CALENDLY_API is None:
+        with _CALENDLY_LOCK:
+            if _CALENDLY_API is None:
+                _CALENDLY_API = MockCalendlyAPI()
+    return _CALENDLY_API
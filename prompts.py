@@ -66,7 +66,7 @@ Remember: You're helping people with their healthcare needs. Be compassionate, p
 """
 
 
-# Prompt template for the main agent
+# Prompt template for the main agent (parsed once at import and shared by every agent and request)
 AGENT_PROMPT = ChatPromptTemplate.from_messages([
     ("system", SYSTEM_PROMPT),
     MessagesPlaceholder(variable_name="chat_history"),
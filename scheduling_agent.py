@@ -3,17 +3,47 @@ Main Scheduling Agent Implementation
 Uses LangChain with Groq LLM and custom tools
 """
 
+import asyncio
+import logging
 import os
-from typing import List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Iterator, List, Dict, Any, Optional
 from langchain_groq import ChatGroq
 from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
 from prompts import AGENT_PROMPT
 from agent_tools import get_agent_tools
 
+logger = logging.getLogger(__name__)
+
+
+# Conversation turns (user message + agent reply) kept per session and sent to the LLM
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "12"))
+
+# Session histories kept in memory, and how long an idle session is kept
+SESSION_CACHE_SIZE = 1024
+SESSION_IDLE_TTL_SECONDS = 3600
+
+
+class BoundedChatMessageHistory(InMemoryChatMessageHistory):
+    """In-memory chat history that keeps only the most recent turns"""
+    
+    max_messages: int = CHAT_HISTORY_TURNS * 2
+    
+    def add_message(self, message: BaseMessage) -> None:
+        """Add a message, dropping the oldest ones once the window is full"""
+        super().add_message(message)
+        if len(self.messages) > self.max_messages:
+            del self.messages[:len(self.messages) - self.max_messages]
+            # Start the window on a user message so turns stay paired
+            while self.messages and not isinstance(self.messages[0], HumanMessage):
+                del self.messages[0]
+
 
 class MedicalSchedulingAgent:
     """
@@ -53,37 +83,85 @@ class MedicalSchedulingAgent:
             timeout=60
         )
         
-        # Get tools
-        self.tools = get_agent_tools()
+        # Tools and the agent executor are built on first use (see agent_executor)
+        self._agent_executor: Optional[AgentExecutor] = None
+        self._agent_with_history: Optional[RunnableWithMessageHistory] = None
+        self._executor_lock = threading.Lock()
         
-        # Create agent
-        self.agent = create_tool_calling_agent(
-            llm=self.llm,
-            tools=self.tools,
-            prompt=AGENT_PROMPT
-        )
+        # Store for chat histories (in-memory, least recently used first)
+        self.chat_histories: "OrderedDict[str, BoundedChatMessageHistory]" = OrderedDict()
+        self._session_last_used: Dict[str, float] = {}
+        self._sessions_lock = threading.Lock()
         
-        # Create agent executor
-        self.agent_executor = AgentExecutor(
-            agent=self.agent,
-            tools=self.tools,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=10,
-            return_intermediate_steps=False,
-            early_stopping_method="generate"
-        )
-        
-        # Store for chat histories (in-memory)
-        self.chat_histories: Dict[str, InMemoryChatMessageHistory] = {}
-        
-        print(f"✓ Medical Scheduling Agent initialized with {model_name}")
+        logger.info("Medical Scheduling Agent initialized with %s", model_name)
+    
+    @property
+    def agent_executor(self) -> AgentExecutor:
+        """Agent executor, created on first use so constructing the agent stays cheap"""
+        if self._agent_executor is None:
+            with self._executor_lock:
+                if self._agent_executor is None:
+                    # Get tools
+                    self.tools = get_agent_tools()
+                    
+                    # Create agent
+                    self.agent = create_tool_calling_agent(
+                        llm=self.llm,
+                        tools=self.tools,
+                        prompt=AGENT_PROMPT
+                    )
+                    
+                    # Create agent executor
+                    agent_executor = AgentExecutor(
+                        agent=self.agent,
+                        tools=self.tools,
+                        verbose=True,
+                        handle_parsing_errors=True,
+                        max_iterations=10,
+                        return_intermediate_steps=False,
+                        early_stopping_method="generate"
+                    )
+                    
+                    # Executor wrapped with per-session history, shared by every chat call
+                    self._agent_with_history = RunnableWithMessageHistory(
+                        agent_executor,
+                        get_session_history=self.get_session_history,
+                        input_messages_key="input",
+                        history_messages_key="chat_history",
+                    )
+                    self._agent_executor = agent_executor
+        return self._agent_executor
+    
+    @property
+    def agent_with_history(self) -> RunnableWithMessageHistory:
+        """Agent executor with chat history, created together with the executor"""
+        if self._agent_with_history is None:
+            _ = self.agent_executor
+        return self._agent_with_history
     
     def get_session_history(self, session_id: str) -> BaseChatMessageHistory:
         """Get or create chat history for a session"""
-        if session_id not in self.chat_histories:
-            self.chat_histories[session_id] = InMemoryChatMessageHistory()
-        return self.chat_histories[session_id]
+        with self._sessions_lock:
+            now = time.monotonic()
+            history = self.chat_histories.get(session_id)
+            if history is None:
+                history = self.chat_histories[session_id] = BoundedChatMessageHistory()
+            else:
+                self.chat_histories.move_to_end(session_id)
+            self._session_last_used[session_id] = now
+            
+            # Evict the least recently used sessions past the cap or idle too long
+            while self.chat_histories:
+                oldest = next(iter(self.chat_histories))
+                if (
+                    len(self.chat_histories) <= SESSION_CACHE_SIZE
+                    and now - self._session_last_used[oldest] <= SESSION_IDLE_TTL_SECONDS
+                ):
+                    break
+                del self.chat_histories[oldest]
+                del self._session_last_used[oldest]
+            
+            return history
     
     def chat(
         self,
@@ -101,19 +179,43 @@ class MedicalSchedulingAgent:
             Agent's response
         """
         try:
-            # Get chat history
-            history = self.get_session_history(session_id)
-            
-            # Create agent with history
-            agent_with_history = RunnableWithMessageHistory(
-                self.agent_executor,
-                get_session_history=self.get_session_history,
-                input_messages_key="input",
-                history_messages_key="chat_history",
+            # Invoke agent
+            response = self.agent_with_history.invoke(
+                {"input": message},
+                config={"configurable": {"session_id": session_id}}
             )
             
+            # Extract output
+            output = response.get("output", "I apologize, but I'm having trouble processing your request. Could you please try again?")
+            
+            return output
+            
+        except Exception as e:
+            logger.exception("Error in chat")
+            return f"I apologize, but I encountered an error: {str(e)}. Please try again or call our office at +1-555-123-4567 for assistance."
+    
+    async def achat(
+        self,
+        message: str,
+        session_id: str = "default"
+    ) -> str:
+        """
+        Async version of chat
+        
+        When the LLM requests several tools in one step (e.g. an FAQ lookup
+        and an availability check), the agent executor runs them
+        concurrently, so the turn takes as long as the slowest tool.
+        
+        Args:
+            message: User's message
+            session_id: Session identifier for conversation history
+            
+        Returns:
+            Agent's response
+        """
+        try:
             # Invoke agent
-            response = agent_with_history.invoke(
+            response = await self.agent_with_history.ainvoke(
                 {"input": message},
                 config={"configurable": {"session_id": session_id}}
             )
@@ -124,14 +226,103 @@ class MedicalSchedulingAgent:
             return output
             
         except Exception as e:
-            print(f"Error in chat: {e}")
+            logger.exception("Error in chat")
             return f"I apologize, but I encountered an error: {str(e)}. Please try again or call our office at +1-555-123-4567 for assistance."
     
+    async def astream(
+        self,
+        message: str,
+        session_id: str = "default"
+    ) -> AsyncIterator[str]:
+        """
+        Process a user message and stream the agent response as it is generated
+        
+        Args:
+            message: User's message
+            session_id: Session identifier for conversation history
+            
+        Yields:
+            Chunks of the agent's response text
+        """
+        try:
+            streamed = False
+            tool_called = False
+            final_output = None
+            
+            async for event in self.agent_with_history.astream_events(
+                {"input": message},
+                config={"configurable": {"session_id": session_id}},
+                version="v2"
+            ):
+                kind = event["event"]
+                
+                if kind == "on_chat_model_stream":
+                    content = event["data"]["chunk"].content
+                    if isinstance(content, str) and content:
+                        # Separate text written before a tool call from the final answer
+                        if streamed and tool_called:
+                            yield "\n\n"
+                        tool_called = False
+                        streamed = True
+                        yield content
+                elif kind == "on_tool_start":
+                    tool_called = True
+                elif kind == "on_chain_end" and not event["parent_ids"]:
+                    final_output = event["data"]["output"].get("output")
+            
+            # Nothing was streamed (e.g. the executor stopped early), so send the final output
+            if not streamed:
+                yield final_output or "I apologize, but I'm having trouble processing your request. Could you please try again?"
+            
+        except Exception as e:
+            logger.exception("Error in chat")
+            yield f"I apologize, but I encountered an error: {str(e)}. Please try again or call our office at +1-555-123-4567 for assistance."
+    
+    def chat_stream(
+        self,
+        message: str,
+        session_id: str = "default"
+    ) -> Iterator[str]:
+        """
+        Synchronous version of astream, for callers without an event loop
+        
+        Like astream, the text includes anything the model wrote before a tool
+        call, so it can differ from chat(), which returns only the final output.
+        Called from a thread that already runs an event loop, it cannot drive
+        astream and yields the complete chat() response as a single chunk.
+        
+        Args:
+            message: User's message
+            session_id: Session identifier for conversation history
+            
+        Yields:
+            Chunks of the agent's response text
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            yield self.chat(message, session_id)
+            return
+        
+        loop = asyncio.new_event_loop()
+        chunks = self.astream(message, session_id)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(chunks.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(chunks.aclose())
+            loop.close()
+    
     def reset_conversation(self, session_id: str = "default"):
         """Reset conversation history for a session"""
         if session_id in self.chat_histories:
             self.chat_histories[session_id].clear()
-            print(f"Conversation history cleared for session: {session_id}")
+            logger.info("Conversation history cleared for session: %s", session_id)
     
     def get_conversation_history(self, session_id: str = "default") -> List[Dict[str, str]]:
         """
@@ -167,6 +358,8 @@ def create_agent(groq_api_key: str = None) -> MedicalSchedulingAgent:
 
 # Example usage
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    
     # Test the agent
     agent = create_agent()
     
@@ -1,125 +1,391 @@
-from pydantic import BaseModel, Field, EmailStr, field_validator
-from typing import Optional, List, Literal
-from datetime import datetime, date, time
+import string
+from functools import lru_cache
 
+from pydantic import (
+    AfterValidator, BaseModel, ConfigDict, Field, StringConstraints, TypeAdapter,
+    computed_field, field_validator, model_validator
+)
+from pydantic.dataclasses import dataclass as pydantic_dataclass
+from typing import Annotated, Any, Mapping, Optional, List, Tuple
+from datetime import datetime, date, time, timezone
+from enum import Enum
 
-class PatientInfo(BaseModel):
+
+class _StrEnum(str, Enum):
+    """Enum whose members are also their string values (StrEnum before Python 3.11)"""
+    
+    def __str__(self) -> str:
+        return self.value
+
+
+class AppointmentKind(_StrEnum):
+    """Appointment type names (the keys of APPOINTMENT_TYPES)"""
+    GENERAL_CONSULTATION = "general_consultation"
+    FOLLOW_UP = "follow_up"
+    PHYSICAL_EXAM = "physical_exam"
+    SPECIALIST_CONSULTATION = "specialist_consultation"
+
+
+class BookingStatus(_StrEnum):
+    """Outcome of a booking request"""
+    CONFIRMED = "confirmed"
+    PENDING = "pending"
+    FAILED = "failed"
+
+
+class ChatRole(_StrEnum):
+    """Author of a chat message"""
+    USER = "user"
+    ASSISTANT = "assistant"
+    SYSTEM = "system"
+
+
+class Phase(_StrEnum):
+    """Stage of the scheduling conversation"""
+    GREETING = "greeting"
+    UNDERSTANDING = "understanding"
+    SCHEDULING = "scheduling"
+    CONFIRMING = "confirming"
+    COMPLETED = "completed"
+    FAQ = "faq"
+
+
+# Characters allowed in the local part and the domain of an (ASCII) email address
+_EMAIL_LOCAL_CHARS = (string.ascii_letters + string.digits + "!#$%&'*+/=?^_`{|}~.-").encode()
+_EMAIL_DOMAIN_CHARS = (string.ascii_letters + string.digits + ".-").encode()
+
+
+def validate_email_address(v: str) -> str:
+    """Check that a value looks like an email address (local@domain.tld), returning it unchanged"""
+    if not v.isascii():
+        raise ValueError('value is not a valid email address')
+    s = v.encode()
+    at = s.rfind(b"@")
+    local, domain = s[:at], s[at + 1:]
+    if (
+        not 1 <= at <= 64
+        # translate(None, allowed) deletes the allowed characters, leaving any others
+        or local.translate(None, _EMAIL_LOCAL_CHARS)
+        or local[0] == 46 or local[-1] == 46 or b".." in local
+        or not 3 <= len(domain) <= 253
+        or domain.translate(None, _EMAIL_DOMAIN_CHARS)
+        or b"." not in domain or b".." in domain
+        or domain[0] in b".-" or domain[-1] in b".-"
+    ):
+        raise ValueError('value is not a valid email address')
+    return v
+
+
+@lru_cache(maxsize=1024)
+def _cached_email_address(v: str) -> str:
+    """validate_email_address, remembering recently accepted addresses (rejections are not cached)"""
+    return validate_email_address(v)
+
+
+# Email address field, checked without the email-validator package: pydantic-core
+# strips it and rejects over-long input before the Python check runs
+EmailAddress = Annotated[
+    str,
+    StringConstraints(strip_whitespace=True, max_length=254),
+    AfterValidator(_cached_email_address)
+]
+
+
+# Request/response models are immutable value objects that reject unknown fields;
+# serialize them with model_dump_json(), not json.dumps(model.model_dump())
+# (dataclasses take frozen from the decorator: pydantic rejects it in both places)
+_DATACLASS_CONFIG = ConfigDict(extra='forbid', str_strip_whitespace=True)
+_DTO_CONFIG = ConfigDict(**_DATACLASS_CONFIG, frozen=True)
+
+
+_DATETIME_ADAPTER = TypeAdapter(datetime)
+
+
+def format_timestamp(ts: int) -> str:
+    """Format a Unix timestamp (seconds) as a UTC ISO 8601 string"""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def _timestamp_input(data: Any, computed_name: str, field_name: str, scale: int) -> Any:
+    """
+    Accept a computed datetime on input by converting it to the stored timestamp
+    
+    Lets model_dump() output, which carries the computed field, be validated again.
+    
+    Args:
+        data: Raw input of the model
+        computed_name: Name of the computed datetime field
+        field_name: Name of the integer timestamp field it is derived from
+        scale: Timestamp units per second
+        
+    Returns:
+        The input, with the computed field replaced by the timestamp field
+    """
+    if isinstance(data, dict) and computed_name in data:
+        data = dict(data)
+        value = data.pop(computed_name)
+        if field_name not in data and value is not None:
+            data[field_name] = int(_DATETIME_ADAPTER.validate_python(value).timestamp() * scale)
+    return data
+
+
+# str.translate table deleting every ASCII character except the digits
+_NON_DIGIT_TABLE = {i: None for i in range(128) if not chr(i).isdigit()}
+
+
+def validate_phone_number(v: str) -> str:
+    """Check that a phone number has at least 10 digits, ignoring separators"""
+    # Too short to hold 10 digits, or nothing but digits already: no need to strip
+    if len(v) < 10:
+        raise ValueError('Phone number must have at least 10 digits')
+    if v.isdigit():
+        return v
+    
+    # Remove common separators (non-ASCII numbers take the slower per-character path)
+    if v.isascii():
+        cleaned = v.translate(_NON_DIGIT_TABLE)
+    else:
+        cleaned = ''.join(filter(str.isdigit, v))
+    if len(cleaned) < 10:
+        raise ValueError('Phone number must have at least 10 digits')
+    return v
+
+
+# Slotted dataclasses (no per-instance __dict__) for the small value types held in bulk
+@pydantic_dataclass(frozen=True, slots=True, config=_DATACLASS_CONFIG)
+class PatientInfo:
     """Patient information for appointment booking"""
     name: str = Field(..., description="Patient's full name")
-    email: EmailStr = Field(..., description="Patient's email address")
+    email: EmailAddress = Field(..., description="Patient's email address")
     phone: str = Field(..., description="Patient's phone number")
     
     @field_validator('phone')
     @classmethod
     def validate_phone(cls, v: str) -> str:
-        # Remove common separators
-        cleaned = ''.join(filter(str.isdigit, v))
-        if len(cleaned) < 10:
-            raise ValueError('Phone number must have at least 10 digits')
-        return v
+        return validate_phone_number(v)
 
 
 class AppointmentType(BaseModel):
     """Appointment type configuration"""
-    type_name: Literal["general_consultation", "follow_up", "physical_exam", "specialist_consultation"]
+    model_config = _DTO_CONFIG
+    
+    type_name: AppointmentKind
     duration_minutes: int
     description: str
 
 
-class TimeSlot(BaseModel):
+@pydantic_dataclass(frozen=True, slots=True, config=_DATACLASS_CONFIG)
+class TimeSlot:
     """Available time slot"""
-    start_time: str = Field(..., description="Start time in HH:MM format")
-    end_time: str = Field(..., description="End time in HH:MM format")
+    start_time: time
+    end_time: time
     available: bool = True
 
 
 class AppointmentRequest(BaseModel):
     """Appointment booking request"""
-    appointment_type: Literal["general_consultation", "follow_up", "physical_exam", "specialist_consultation"]
-    appointment_date: str = Field(..., description="Date in YYYY-MM-DD format")
-    start_time: str = Field(..., description="Start time in HH:MM format")
+    model_config = _DTO_CONFIG
+    
+    appointment_type: AppointmentKind
+    appointment_date: date = Field(..., description="Date in YYYY-MM-DD format")
+    start_time: time = Field(..., description="Start time in HH:MM format")
     patient: PatientInfo
     reason: str = Field(..., description="Reason for visit")
 
 
+class BookAppointmentArgs(BaseModel):
+    """Arguments of the book_appointment tool, validated in one pass before the tool runs"""
+    # Unknown keys are tolerated: the LLM occasionally sends extra arguments
+    model_config = ConfigDict(frozen=True, str_strip_whitespace=True)
+    
+    patient_name: str = Field(..., min_length=1, description="Patient's full name")
+    patient_email: EmailAddress = Field(..., description="Patient's email address")
+    patient_phone: str = Field(..., description="Patient's phone number")
+    appointment_type: AppointmentKind
+    appointment_date: date = Field(..., description="Date in YYYY-MM-DD format")
+    start_time: time = Field(..., description="Start time in HH:MM format (24-hour, e.g., \"14:00\" for 2:00 PM)")
+    reason: str = Field(..., min_length=1, description="Brief reason for the visit")
+    
+    @field_validator('patient_phone')
+    @classmethod
+    def validate_phone(cls, v: str) -> str:
+        return validate_phone_number(v)
+
+
 class AppointmentResponse(BaseModel):
-    """Appointment booking response"""
+    """
+    Appointment booking response
+    
+    Built only from values the calendar has already validated, so it may be
+    created with model_construct (see mock_calendly._appointment_response).
+    """
+    # Only built after a booking attempt, so its validator is compiled on first use
+    model_config = ConfigDict(**_DTO_CONFIG, defer_build=True)
+    
     booking_id: str
-    status: Literal["confirmed", "pending", "failed"]
+    status: BookingStatus
     confirmation_code: str
     appointment_type: str
-    date: str
-    start_time: str
-    end_time: str
+    date: date
+    start_time: time
+    end_time: Optional[time]  # None when the booking failed
     patient_name: str
     patient_email: str
     reason: str
-    created_at: str
+    created_at_ts: int = Field(default_factory=lambda: int(datetime.now(timezone.utc).timestamp()))
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _accept_created_at(cls, data: Any) -> Any:
+        return _timestamp_input(data, "created_at", "created_at_ts", 1)
+    
+    @computed_field
+    @property
+    def created_at(self) -> str:
+        """Creation time (UTC, ISO 8601), formatted only when read or serialized"""
+        return format_timestamp(self.created_at_ts)
 
 
 class AvailabilityRequest(BaseModel):
     """Request for checking availability"""
-    date: str = Field(..., description="Date in YYYY-MM-DD format")
-    appointment_type: Literal["general_consultation", "follow_up", "physical_exam", "specialist_consultation"]
+    model_config = _DTO_CONFIG
+    
+    date: date  # no Field(): a class attribute named date would shadow the type
+    appointment_type: AppointmentKind
 
 
 class AvailabilityResponse(BaseModel):
-    """Response with available time slots"""
-    date: str
+    """
+    Response with available time slots
+    
+    all_slots is the (shared) slot grid of the appointment type and bit i of
+    available_mask marks all_slots[i] as available. Neither is serialized: the
+    output carries date, appointment_type, total_slots and available_slots, and
+    that output validates again.
+    """
+    model_config = _DTO_CONFIG
+    
+    date: date
     appointment_type: str
-    available_slots: List[TimeSlot]
+    all_slots: Tuple[TimeSlot, ...] = Field(default=(), exclude=True)
+    available_mask: int = Field(default=0, exclude=True)
     total_slots: int
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _accept_available_slots(cls, data: Any) -> Any:
+        # A list of available slots becomes a grid of its own with every bit set
+        if isinstance(data, dict) and "available_slots" in data:
+            data = dict(data)
+            slots = data.pop("available_slots")
+            if "all_slots" not in data and slots:
+                data["all_slots"] = tuple(slots)
+                data["available_mask"] = (1 << len(data["all_slots"])) - 1
+        return data
+    
+    @computed_field
+    @property
+    def available_slots(self) -> List[TimeSlot]:
+        """The available slots, in start time order"""
+        mask = self.available_mask
+        return [slot for i, slot in enumerate(self.all_slots) if mask >> i & 1]
 
 
 class ChatMessage(BaseModel):
     """Chat message model"""
-    role: Literal["user", "assistant", "system"]
+    model_config = _DTO_CONFIG
+    
+    role: ChatRole
     content: str
-    timestamp: Optional[datetime] = None
+    ts_ms: int = Field(default_factory=lambda: int(datetime.now(timezone.utc).timestamp() * 1000))
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _accept_timestamp(cls, data: Any) -> Any:
+        return _timestamp_input(data, "timestamp", "ts_ms", 1000)
+    
+    @computed_field
+    @property
+    def timestamp(self) -> datetime:
+        """When the message was created (UTC), derived from ts_ms"""
+        return datetime.fromtimestamp(self.ts_ms / 1000, tz=timezone.utc)
 
 
 class AgentState(BaseModel):
     """Agent conversation state"""
     conversation_id: str
-    phase: Literal["greeting", "understanding", "scheduling", "confirming", "completed", "faq"]
-    appointment_data: Optional[dict] = None
-    patient_info: Optional[PatientInfo] = None
-    preferred_date: Optional[str] = None
-    preferred_time: Optional[str] = None
-    appointment_type: Optional[str] = None
-    reason_for_visit: Optional[str] = None
+    phase: Phase
+    appointment_data: dict = Field(default_factory=dict)
+    patient_info: Optional[PatientInfo] = None  # None until the patient's details are collected
+    preferred_date: str = ""
+    preferred_time: str = ""
+    appointment_type: str = ""
+    reason_for_visit: str = ""
+
+
+class _ReadOnlyDict(dict):
+    """
+    dict that refuses changes after construction
+    
+    Unlike a MappingProxyType view it is still a dict, so it pickles, deep-copies
+    and serializes (json, orjson, pydantic) like the plain dicts it replaces.
+    """
+    
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"'{type(self).__name__}' object is read-only")
+    
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    
+    def __reduce__(self):
+        # Rebuild from the items instead of setting them one by one after creation
+        return type(self), (dict(self),)
 
 
-# Appointment type configurations
+# Appointment type configurations (entries are read-only)
 APPOINTMENT_TYPES = {
-    "general_consultation": {
+    "general_consultation": _ReadOnlyDict({
         "duration": 30,
         "description": "Standard consultation for new health concerns, chronic condition management, or general check-ups"
-    },
-    "follow_up": {
+    }),
+    "follow_up": _ReadOnlyDict({
         "duration": 15,
         "description": "Brief follow-up for ongoing treatment, test result review, or medication adjustment"
-    },
-    "physical_exam": {
+    }),
+    "physical_exam": _ReadOnlyDict({
         "duration": 45,
         "description": "Comprehensive annual physical examination including health screening and preventive care"
-    },
-    "specialist_consultation": {
+    }),
+    "specialist_consultation": _ReadOnlyDict({
         "duration": 60,
         "description": "Extended consultation for complex conditions requiring specialist expertise"
-    }
+    })
 }
 
+# Duration in minutes of each appointment type, for lookups that need nothing else
+APPOINTMENT_DURATIONS = {name: info["duration"] for name, info in APPOINTMENT_TYPES.items()}
+
 
 # Business configuration
+_BUSINESS_HOURS = _ReadOnlyDict({
+    "start": "09:00",
+    "end": "17:00",
+    "days": ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday")
+})
+
+
 class BusinessConfig(BaseModel):
     """Clinic business configuration"""
+    model_config = ConfigDict(defer_build=True)
+    
     name: str = "HealthCare Plus Clinic"
     phone: str = "+1-555-123-4567"
     email: str = "info@healthcareplus.com"
     timezone: str = "America/New_York"
-    business_hours: dict = {
-        "start": "09:00",
-        "end": "17:00",
-        "days": ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-    }
+    business_hours: Mapping[str, Any] = Field(default_factory=lambda: _BUSINESS_HOURS)
+
+
+# Prebuilt validators for the models constructed on every agent turn
+PATIENT_ADAPTER = TypeAdapter(PatientInfo)
+APPOINTMENT_REQUEST_ADAPTER = TypeAdapter(AppointmentRequest)
+AVAILABILITY_REQUEST_ADAPTER = TypeAdapter(AvailabilityRequest)